@@ -3,7 +3,7 @@ import os
 import shutil
 from PIL import Image
 from fpdf import FPDF
-from modules import profiler, llm_analyzer, explainability, chronos, integrity
+from modules import profiler, llm_analyzer, explainability, chronos, integrity, prnu
 import pytz
 
 # 1. Page Config
@@ -21,6 +21,7 @@ if 'case_data' not in st.session_state:
         "shadow_verdict": "Not Run",
         "integrity_hash": "Not Run",
         "integrity_verdict": "Not Run",
+        "prnu_matches": "Not Run",
         "vision_metrics": {}
     }
 
@@ -35,6 +36,7 @@ def reset_app():
         "shadow_verdict": "Not Run",
         "integrity_hash": "Not Run",
         "integrity_verdict": "Not Run",
+        "prnu_matches": "Not Run",
         "vision_metrics": {}
     }
     st.rerun()
@@ -262,6 +264,45 @@ elif mode == "5. Digital Integrity Check":
                 
                 # SAVE TO SESSION
                 st.session_state['case_data']['integrity_verdict'] = verdict
+
+        st.markdown("---")
+        st.subheader("📷 Sensor Fingerprint (PRNU) Source Identification")
+        st.caption("Matches the sensor noise of the evidence against enrolled camera fingerprints. Unlike EXIF, PRNU cannot be stripped by re-saving.")
+
+        col3, col4 = st.columns(2)
+        with col3:
+            with st.expander("Enroll Reference Camera"):
+                cam_label = st.text_input("Camera Label", placeholder="e.g. Suspect Phone (Pixel 7)")
+                ref_frames = st.file_uploader("Reference Frames (flat, well-lit scenes work best)", type=['jpg', 'png', 'jpeg'], accept_multiple_files=True)
+                replace_existing = st.checkbox("Replace existing fingerprint with this label")
+                if st.button("Build Fingerprint"):
+                    if not cam_label or not ref_frames:
+                        st.error("Provide a label and at least one reference frame.")
+                    else:
+                        try:
+                            with st.spinner("Estimating sensor fingerprint..."):
+                                fingerprint = prnu.build_fingerprint(ref_frames)
+                                total = prnu.add_to_library(cam_label, fingerprint, frame_count=len(ref_frames), replace=replace_existing)
+                            st.success(f"Enrolled '{cam_label}'. Library now holds {total} camera(s).")
+                        except ValueError as e:
+                            st.error(str(e))
+        with col4:
+            if st.button("Match Sensor Fingerprint"):
+                try:
+                    with st.spinner("Correlating against fingerprint library..."):
+                        matches = prnu.match_frame(evidence_path)
+                    if not matches:
+                        st.info("Fingerprint library is empty. Enroll a reference camera first.")
+                    else:
+                        st.table(matches)
+                        if matches[0]["PCE"] > prnu.PCE_THRESHOLD:
+                            st.success(f"Source camera identified: {matches[0]['Camera']}")
+                        else:
+                            st.info("No enrolled camera matches this frame.")
+                        # SAVE TO SESSION
+                        st.session_state['case_data']['prnu_matches'] = matches
+                except ValueError as e:
+                    st.error(str(e))
     else:
         st.error("⚠️ No Evidence Found.")
 
@@ -39,12 +39,20 @@ def generate_forensic_report(image_path, api_key, metrics=None, user_timezone="U
         skel = metrics.get('skeletal_analysis', 'Not Run')
         shadow = metrics.get('shadow_verdict', 'Not Run')
         integrity = metrics.get('integrity_verdict', 'Not Run')
+        prnu_matches = metrics.get('prnu_matches', 'Not Run')
+        
+        # Summarise PRNU matches as "Camera (PCE x, Verdict)"
+        if isinstance(prnu_matches, list):
+            prnu_matches = "; ".join(
+                f"{m['Camera']} (PCE {m['PCE']}, {m['Verdict']})" for m in prnu_matches
+            ) or "No cameras enrolled"
         
         metrics_context = f"""
         SYSTEM DETECTED METRICS (HARD DATA):
         - Skeletal Analysis Verdict: {skel}
         - Shadow/Physics Verdict: {shadow}
         - Digital Integrity Verdict: {integrity}
+        - Sensor Fingerprint (PRNU) Top Matches: {prnu_matches}
         """
 
     prompt = f"""
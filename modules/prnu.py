@@ -0,0 +1,384 @@
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# Fingerprints are computed on a fixed centre crop so every camera in the
+# library shares one shape and can be correlated as a single stacked batch.
+FINGERPRINT_SIZE = 512
+PRNU_LIBRARY_DIR = "fingerprints"
+PCE_THRESHOLD = 60.0  # Standard PRNU decision threshold (Goljan et al.)
+
+_INDEX_FILE = "index.json"
+_LOCK_FILE = ".lock"
+_LOCK_TIMEOUT = 30.0  # Seconds to wait for another enrolment to finish
+_LIBRARY_LOCK = threading.Lock()  # Streamlit sessions share one process
+_ENROL_BATCH = 8  # Reference frames denoised together; bounds enrolment memory
+_QUANT_RANGE = 4.0  # Fingerprints are stored as int8 over +/- 4 standard deviations
+# Peak working set per camera in a batch: float32 planes plus complex spectra
+# (complex128 on NumPy < 2), measured at ~22 bytes/pixel and rounded up.
+_BYTES_PER_CAMERA = 32 * FINGERPRINT_SIZE * FINGERPRINT_SIZE
+# Scratch memory shared by all matcher threads. Kept small because the hosted
+# Streamlit deployment has a tight memory cap; batches shrink to fit it
+# rather than threads being dropped.
+MATCH_MEMORY_BUDGET_MB = 256
+_PEAK_EXCLUSION = 5  # Half-width of the window around the peak ignored for PCE
+
+
+def _load_gray(image_source):
+    """
+    Loads an image (path or file-like) as a float32 luminance centre crop.
+    """
+    img = Image.open(image_source)
+    w, h = img.size
+    if min(h, w) < FINGERPRINT_SIZE:
+        raise ValueError(
+            f"Image is {w}x{h}; PRNU needs at least {FINGERPRINT_SIZE}x{FINGERPRINT_SIZE} pixels."
+        )
+    top = (h - FINGERPRINT_SIZE) // 2
+    left = (w - FINGERPRINT_SIZE) // 2
+    # Crop before converting so only the crop is ever held as float32.
+    crop = img.crop((left, top, left + FINGERPRINT_SIZE, top + FINGERPRINT_SIZE)).convert('RGB')
+    return np.asarray(crop, dtype=np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _box_mean(x, radius):
+    """
+    Local mean over a (2r+1)^2 window on the last two axes, via summed-area tables.
+    """
+    k = 2 * radius + 1
+    pad = [(0, 0)] * (x.ndim - 2) + [(radius + 1, radius), (radius + 1, radius)]
+    # Accumulate in float64: squared intensities summed over a 512x512 crop
+    # reach ~1e10, well beyond float32's exact range.
+    sat = np.pad(x, pad, mode='reflect').cumsum(axis=-2, dtype=np.float64).cumsum(axis=-1)
+    window = sat[..., k:, k:] - sat[..., :-k, k:] - sat[..., k:, :-k] + sat[..., :-k, :-k]
+    return (window / (k * k)).astype(x.dtype)
+
+
+def _zero_mean(x):
+    """
+    Removes row and column means on the last two axes, suppressing linear
+    patterns (readout/JPEG artefacts) shared by all cameras of a model.
+    """
+    x = x - x.mean(axis=-1, keepdims=True)
+    return x - x.mean(axis=-2, keepdims=True)
+
+
+def noise_residual(frames, sigma=3.0):
+    """
+    Extracts sensor-noise residuals W = I - denoise(I) for a stack of frames.
+
+    `frames` has shape (N, H, W) or (H, W). Denoising is an adaptive local
+    Wiener filter (minimum variance over several window sizes), vectorized
+    across the whole stack. Row/column means are removed afterwards to
+    suppress linear patterns shared by all cameras of a model.
+    """
+    x = np.asarray(frames, dtype=np.float32)
+    noise_var = sigma ** 2
+
+    local_var = None
+    local_mean = None
+    for radius in (1, 2, 3, 4):
+        mean = _box_mean(x, radius)
+        var = np.maximum(_box_mean(x * x, radius) - mean * mean, 0.0)
+        if local_var is None:
+            local_var, local_mean = var, mean
+        else:
+            closer = var < local_var
+            local_var = np.where(closer, var, local_var)
+            local_mean = np.where(closer, mean, local_mean)
+
+    gain = np.maximum(local_var - noise_var, 0.0) / np.maximum(local_var, noise_var)
+    denoised = local_mean + gain * (x - local_mean)
+    return _zero_mean(x - denoised)
+
+
+def build_fingerprint(image_sources):
+    """
+    Estimates a camera PRNU fingerprint K from reference frames.
+
+    Uses the maximum-likelihood estimate K = sum(W * I) / sum(I^2),
+    ignoring saturated pixels which carry no sensor noise. Frames are
+    denoised in fixed-size batches and the sums accumulated, so peak memory
+    does not grow with the number of frames. The estimate is then
+    zero-meaned by rows and columns to strip non-unique artefacts.
+    """
+    if len(image_sources) == 0:
+        raise ValueError("At least one reference frame is required.")
+
+    numerator = np.zeros((FINGERPRINT_SIZE, FINGERPRINT_SIZE), dtype=np.float64)
+    denominator = np.ones((FINGERPRINT_SIZE, FINGERPRINT_SIZE), dtype=np.float64)
+    for start in range(0, len(image_sources), _ENROL_BATCH):
+        frames = np.stack([_load_gray(src) for src in image_sources[start:start + _ENROL_BATCH]])
+        residuals = noise_residual(frames)
+        weights = np.where(frames < 250.0, frames, 0.0)
+        numerator += (residuals * weights).sum(axis=0)
+        denominator += (weights * weights).sum(axis=0)
+
+    fingerprint = numerator / denominator
+    return _zero_mean(fingerprint).astype(np.float32)
+
+
+def _read_index(library_dir):
+    """
+    Reads and validates index.json; returns None if the library does not exist.
+    """
+    index_path = os.path.join(library_dir, _INDEX_FILE)
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        raise ValueError(f"Fingerprint library is corrupt: {index_path} is not valid JSON.")
+
+    cameras = index.get("cameras") if isinstance(index, dict) else None
+    if (
+        not isinstance(cameras, list)
+        or not isinstance(index.get("data"), str)
+        or not all(
+            isinstance(e, dict) and isinstance(e.get("label"), str)
+            and isinstance(e.get("scale"), (int, float))
+            for e in cameras
+        )
+    ):
+        raise ValueError(f"Fingerprint library is corrupt: {index_path} is malformed.")
+
+    if index.get("size") != FINGERPRINT_SIZE:
+        raise ValueError(
+            f"Fingerprint library was built at {index.get('size')}px but this version uses "
+            f"{FINGERPRINT_SIZE}px. Re-enroll the cameras into a fresh library."
+        )
+    return index
+
+
+def load_library(library_dir=PRNU_LIBRARY_DIR, mmap_mode='r'):
+    """
+    Returns (entries, data) for the on-disk library.
+
+    `data` is an int8 array of shape (N, S, S), memory-mapped read-only by
+    default; `entries` holds the per-camera label, scale and enrolment
+    details from the index. Raises ValueError if the index and data disagree.
+    """
+    # An enrolment may swap the index and delete the stack it just read
+    # between the two reads; re-reading the index once picks up the new one.
+    for attempt in range(2):
+        index = _read_index(library_dir)
+        if index is None:
+            return [], None
+
+        data_path = os.path.join(library_dir, index["data"])
+        try:
+            data = np.load(data_path, mmap_mode=mmap_mode)
+            break
+        except FileNotFoundError:
+            if attempt:
+                raise ValueError(f"Fingerprint library is corrupt: data file {data_path} is missing.")
+
+    entries = index["cameras"]
+    if data.shape != (len(entries), FINGERPRINT_SIZE, FINGERPRINT_SIZE):
+        raise ValueError(
+            f"Fingerprint library is corrupt: index lists {len(entries)} camera(s) "
+            f"but data holds shape {data.shape}."
+        )
+    return entries, data
+
+
+def _try_lock(fd):
+    """
+    Takes a non-blocking exclusive OS lock on an open file; False if held elsewhere.
+    """
+    try:
+        if os.name == 'nt':
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if os.name == 'nt':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _library_lock(library_dir):
+    """
+    Serializes library updates across threads and processes.
+
+    Holds an OS lock on the lock file, which the OS releases if the process
+    dies mid-enrolment, so a crash never leaves the library locked.
+    """
+    lock_path = os.path.join(library_dir, _LOCK_FILE)
+    with _LIBRARY_LOCK:
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            deadline = time.monotonic() + _LOCK_TIMEOUT
+            while not _try_lock(fd):
+                if time.monotonic() > deadline:
+                    raise ValueError("Fingerprint library is busy with another enrolment. Try again shortly.")
+                time.sleep(0.1)
+            try:
+                yield
+            finally:
+                _unlock(fd)
+        finally:
+            os.close(fd)
+
+
+def _write_durable(path, write):
+    with open(path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def add_to_library(label, fingerprint, library_dir=PRNU_LIBRARY_DIR, frame_count=None, replace=False):
+    """
+    Quantizes a fingerprint to int8 and adds it to the library.
+
+    An existing label raises ValueError unless `replace` is set, in which case
+    that camera's fingerprint is overwritten. The new data stack is written
+    under a fresh name and the index is swapped in atomically last, so a
+    crash leaves the previous library intact.
+    """
+    os.makedirs(library_dir, exist_ok=True)
+
+    scale = float(fingerprint.std()) * _QUANT_RANGE / 127.0 or 1.0
+    quantized = np.clip(np.round(fingerprint / scale), -127, 127).astype(np.int8)
+    entry = {
+        "label": label,
+        "scale": scale,
+        "frames": frame_count,
+        "enrolled": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+    with _library_lock(library_dir):
+        # Loaded fully into memory so no map on the old data file stays open.
+        entries, data = load_library(library_dir, mmap_mode=None)
+
+        labels = [e["label"] for e in entries]
+        if label in labels:
+            if not replace:
+                raise ValueError(f"A camera labelled '{label}' is already enrolled.")
+            row = labels.index(label)
+            stacked = data.copy()
+            stacked[row] = quantized
+            entries[row] = entry
+        else:
+            stacked = quantized[None] if data is None else np.concatenate([data, quantized[None]])
+            entries.append(entry)
+
+        data_name = f"fingerprints-{uuid.uuid4().hex[:12]}.npy"
+        _write_durable(os.path.join(library_dir, data_name), lambda f: np.save(f, stacked))
+
+        index = {"size": FINGERPRINT_SIZE, "data": data_name, "cameras": entries}
+        index_tmp = os.path.join(library_dir, _INDEX_FILE + ".tmp")
+        _write_durable(index_tmp, lambda f: f.write(json.dumps(index, indent=2).encode("utf-8")))
+        os.replace(index_tmp, os.path.join(library_dir, _INDEX_FILE))
+
+        # Drop superseded stacks; a file still mapped by a running match
+        # (Windows) is left behind and removed on a later enrolment.
+        for old_path in glob.glob(os.path.join(library_dir, "fingerprints*.npy")):
+            if os.path.basename(old_path) != data_name:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    return len(entries)
+
+
+def _pce(correlation):
+    """
+    Peak-to-Correlation Energy for a batch of (N, S, S) cross-correlation surfaces.
+    """
+    n, h, w = correlation.shape
+    flat = correlation.reshape(n, -1)
+    peak_idx = flat.argmax(axis=1)
+    peak = flat[np.arange(n), peak_idx]
+
+    rows, cols = np.unravel_index(peak_idx, (h, w))
+    offsets = np.arange(-_PEAK_EXCLUSION, _PEAK_EXCLUSION + 1)
+    r = (rows[:, None, None] + offsets[None, :, None]) % h
+    c = (cols[:, None, None] + offsets[None, None, :]) % w
+    neighbourhood = correlation[np.arange(n)[:, None, None], r, c]
+
+    excluded = neighbourhood.size // n
+    energy = ((flat ** 2).sum(axis=1) - (neighbourhood ** 2).reshape(n, -1).sum(axis=1))
+    energy /= (h * w - excluded)
+    return np.sign(peak) * peak ** 2 / np.maximum(energy, 1e-12)
+
+
+def _batch_plan(n_cameras, workers, memory_budget_mb):
+    """
+    Returns (workers, cameras per batch) so all batches in flight fit the budget.
+
+    Threads default to the CPU count; the budget is split between them and
+    sets each thread's batch size. Threads are only reduced when the budget
+    cannot hold even one camera per thread.
+    """
+    budget_cameras = max(1, int(memory_budget_mb * 2 ** 20 // _BYTES_PER_CAMERA))
+    workers = max(1, min(workers or os.cpu_count() or 1, n_cameras, budget_cameras))
+    chunk = max(1, min(budget_cameras // workers, -(-n_cameras // workers)))
+    return workers, chunk
+
+
+def match_frame(image_path, library_dir=PRNU_LIBRARY_DIR, top_k=5, workers=None,
+                memory_budget_mb=MATCH_MEMORY_BUDGET_MB):
+    """
+    Correlates a questioned frame against every stored fingerprint.
+
+    The frame's residual spectrum is computed once; fingerprints are then
+    processed in batches of stacked FFTs spread over a thread pool, with
+    the batch size chosen so the batches in flight stay within
+    `memory_budget_mb`. Returns the top matches sorted by PCE score.
+    """
+    entries, data = load_library(library_dir)
+    if not entries:
+        return []
+
+    frame = _load_gray(image_path)
+    residual = noise_residual(frame)
+    residual_fft = np.conj(np.fft.rfft2(residual))
+    scales = np.array([e["scale"] for e in entries], dtype=np.float32)
+
+    workers, chunk = _batch_plan(len(entries), workers, memory_budget_mb)
+
+    def correlate_chunk(start):
+        stop = min(start + chunk, len(entries))
+        expected = frame[None] * (data[start:stop].astype(np.float32) * scales[start:stop, None, None])
+        expected -= expected.mean(axis=(-2, -1), keepdims=True)
+        correlation = np.fft.irfft2(np.fft.rfft2(expected) * residual_fft, s=frame.shape)
+        return _pce(correlation)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        scores = np.concatenate(list(pool.map(correlate_chunk, range(0, len(entries), chunk))))
+
+    order = np.argsort(scores)[::-1][:top_k]
+    return [
+        {
+            "Camera": entries[i]["label"],
+            "PCE": round(float(scores[i]), 1),
+            "Verdict": "✅ Match" if scores[i] > PCE_THRESHOLD else "❌ No Match",
+        }
+        for i in order
+    ]